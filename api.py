@@ -6,17 +6,64 @@ Zulässig:
 - deine App (Android / Windows)
 """
 
-from fastapi import FastAPI, Request, HTTPException
+from fastapi import FastAPI, Request, HTTPException, Query, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from pathlib import Path
-from firebase_admin import auth
-from cedmate_analytics import generate_analytics_for_user
+from contextlib import asynccontextmanager, contextmanager
+from dataclasses import dataclass
+from typing import Literal
+from cachetools import TTLCache
+from cedmate_analytics import generate_analytics_for_user_async, get_db, get_async_db, create_plot_executor
+from cedmate_analytics import OUTPUT_DIR, LOG_FORMAT
 from export_pdf import generate_export_pdf_for_user   # ← DAS FEHLTE
+from logging.handlers import QueueHandler, QueueListener
+import hmac
+import json
+import logging
+import queue
 import re
 import os
 
-app = FastAPI(title="CEDmate Analytics API", version="3.1")
+logger = logging.getLogger(__name__)
+
+
+@contextmanager
+def queued_logging():
+    """
+    INFO-Logging über eine Queue: Requests legen Records nur ab,
+    Formatierung und Ausgabe übernimmt der Hintergrund-Thread des QueueListeners.
+    """
+    log_queue = queue.SimpleQueue()
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    queue_handler = QueueHandler(log_queue)
+    root = logging.getLogger()
+    root.addHandler(queue_handler)
+    root.setLevel(logging.INFO)
+    listener = QueueListener(log_queue, stream_handler)
+    listener.start()
+    try:
+        yield
+    finally:
+        listener.stop()
+        root.removeHandler(queue_handler)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    with queued_logging():
+        # Firestore-Clients einmal beim Start erzeugen und für alle Requests wiederverwenden:
+        # AsyncClient für /analytics (im Event-Loop), Sync-Client für den PDF-Export
+        app.state.db = get_db()
+        app.state.async_db = get_async_db()
+        # Prozess-Pool fürs parallele Rendern der Diagramme (nur mit PLOT_WORKERS > 0)
+        app.state.plot_executor = create_plot_executor()
+        yield
+        if app.state.plot_executor is not None:
+            app.state.plot_executor.shutdown(wait=False, cancel_futures=True)
+
+
+app = FastAPI(title="CEDmate Analytics API", version="3.1", lifespan=lifespan)
 
 # -------------------------------------------------------------------
 # KONFIGURATION
@@ -34,120 +81,224 @@ ALLOWED_ORIGINS = [
     "http://127.0.0.1",
 ]
 
+# 🧪 Lokale Entwicklung: localhost / 127.0.0.1 mit beliebigem Port
+LOCALHOST_REGEX = r"^https?://(localhost|127\.0\.0\.1)(:\d+)?$"
+
 # 🖥️ Vertrauenswürdige User-Agents (App-Erkennung)
 TRUSTED_USER_AGENTS = ["CEDmate", "okhttp", "dart:io", "flutter"]
 
+# 🔗 Öffentliche Basis-URL der generierten Dateien (Render)
+BASE_OUTPUT_URL = "https://cedmate-analytics-api.onrender.com/output/"
+
+# ⏱️ Analytics-Ergebnisse pro User kurz zwischenspeichern (PNGs liegen bereits in output/)
+ANALYTICS_CACHE_TTL = int(os.getenv("ANALYTICS_CACHE_TTL", "300"))
+_analytics_cache = TTLCache(maxsize=512, ttl=ANALYTICS_CACHE_TTL)
+
+
+@dataclass(frozen=True, slots=True)
+class AppConfig:
+    """
+    Zugriffsregeln, einmal beim Import aus den Einstellungen oben vorberechnet.
+    Origins und User-Agents als bytes, damit die rohen ASGI-Header nicht dekodiert werden müssen.
+    """
+    api_key: bytes
+    origin_set: frozenset[bytes]
+    localhost_re: re.Pattern
+    ua_tokens: tuple[bytes, ...]
+
+    @classmethod
+    def build(cls, api_key: str, allowed_origins: list[str], localhost_regex: str,
+              trusted_user_agents: list[str]) -> "AppConfig":
+        if not api_key:
+            raise ValueError("API_KEY darf nicht leer sein")
+        return cls(
+            api_key=api_key.encode("utf-8"),
+            origin_set=frozenset(o.encode("latin-1") for o in allowed_origins),
+            localhost_re=re.compile(localhost_regex.encode("latin-1")),
+            ua_tokens=tuple(t.lower().encode("latin-1") for t in trusted_user_agents),
+        )
+
+    def is_allowed_origin(self, origin: bytes) -> bool:
+        return origin in self.origin_set or self.localhost_re.match(origin) is not None
+
+    def is_allowed_user_agent(self, agent: bytes) -> bool:
+        # Reine Teilstring-Suche: die Muster enthalten keine Regex-Sonderzeichen
+        agent = agent.lower()
+        return any(t in agent for t in self.ua_tokens)
+
+
+CONFIG = AppConfig.build(API_KEY, ALLOWED_ORIGINS, LOCALHOST_REGEX, TRUSTED_USER_AGENTS)
+
+# -------------------------------------------------------------------
+# ZUGRIFFSSCHUTZ (reine ASGI-Middleware)
+# -------------------------------------------------------------------
+# Endpunkte, die API-Key + Origin/User-Agent erfordern
+PROTECTED_PATHS = frozenset({"/analytics", "/analytics/invalidate", "/export"})
+
+
+class AuthMiddleware:
+    """
+    Prüft x-api-key, Origin und User-Agent direkt auf scope["headers"],
+    bevor FastAPI ein Request-Objekt baut oder den Endpunkt aufruft.
+    Nur erlaubt:
+      - wenn gültiger x-api-key vorhanden ist
+      - wenn Origin zu ALLOWED_ORIGINS gehört (Web)
+      - oder App-User-Agent erkannt wird (Mobile/Desktop)
+    """
+
+    def __init__(self, app, config: AppConfig = CONFIG):
+        self.app = app
+        self.config = config
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in PROTECTED_PATHS:
+            await self.app(scope, receive, send)
+            return
+
+        key = None
+        origin = agent = b""
+        for name, value in scope["headers"]:
+            if name == b"x-api-key":
+                key = value
+            elif name == b"origin":
+                origin = value
+            elif name == b"user-agent":
+                agent = value
+
+        # 1️⃣ API-Key prüfen (Bytes, zeitkonstant gegen Timing-Angriffe); fehlender Header = ungültig
+        if key is None or not hmac.compare_digest(key, self.config.api_key):
+            await self._reject(send, 401, "Unauthorized: Invalid API key")
+            return
+
+        # 2️⃣ Herkunft (Origin) prüfen – für Web-Aufrufe
+        if origin and not self.config.is_allowed_origin(origin):
+            await self._reject(send, 403, f"Forbidden origin: {origin.decode('latin-1')}")
+            return
+
+        # 3️⃣ User-Agent prüfen – für native Apps (APK / Windows)
+        if not origin and not self.config.is_allowed_user_agent(agent):
+            await self._reject(send, 403, "Forbidden: Invalid User-Agent")
+            return
+
+        await self.app(scope, receive, send)
+
+    @staticmethod
+    async def _reject(send, status: int, detail: str):
+        # Gleiches Format wie HTTPException: {"detail": "..."}
+        body = json.dumps({"detail": detail}).encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode("latin-1")),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
+
 # -------------------------------------------------------------------
 # STATIC FILES (macht Diagramme öffentlich erreichbar)
 # -------------------------------------------------------------------
-output_dir = Path(__file__).resolve().parent / "output"
-output_dir.mkdir(exist_ok=True)
-app.mount("/output", StaticFiles(directory=output_dir), name="output")
+# Gleiches Verzeichnis, in das cedmate_analytics schreibt (legt es beim Import an)
+app.mount("/output", StaticFiles(directory=OUTPUT_DIR), name="output")
 
 # -------------------------------------------------------------------
-# CORS-Einstellungen
+# Middleware
 # -------------------------------------------------------------------
+# Zuerst registriert = innen: CORS (außen) beantwortet Preflights selbst
+# und ergänzt CORS-Header auch bei 401/403 aus AuthMiddleware.
+app.add_middleware(AuthMiddleware, config=CONFIG)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=ALLOWED_ORIGINS,
-    allow_credentials=True,
-    allow_methods=["GET"],
+    allow_origin_regex=LOCALHOST_REGEX,
+    allow_methods=["GET", "POST"],
     allow_headers=["x-api-key", "Content-Type", "Authorization"],
+    max_age=86400,  # Browser dürfen Preflight-Antworten 24 h cachen
 )
 
 # -------------------------------------------------------------------
 # Healthcheck
 # -------------------------------------------------------------------
+# Antwort einmal serialisieren; pro Request wird nur ein Response-Objekt um die fertigen
+# Bytes gebaut (keine geteilte Instanz, da Middleware die Header-Liste pro Antwort ergänzt)
+_HEALTH_BODY = json.dumps({"status": "ok", "message": "CEDmate Analytics API aktiv"}).encode("utf-8")
+
+
 @app.get("/")
-def root():
-    return {"status": "ok", "message": "CEDmate Analytics API aktiv"}
+async def root():
+    return Response(content=_HEALTH_BODY, media_type="application/json")
 
 # -------------------------------------------------------------------
 # Hauptendpunkt: /analytics
 # -------------------------------------------------------------------
 @app.get("/analytics")
-async def analytics(request: Request, user: str):
+async def analytics(request: Request, user: str,
+                    fmt: Literal["png", "svg"] = Query("png", alias="format")):
     """
     Generiert Analysen für einen Benutzer (user = Firebase UID)
-    Nur erlaubt:
-      - wenn gültiger x-api-key vorhanden ist
-      - wenn Origin zu ALLOWED_ORIGINS gehört (Web)
-      - oder App-User-Agent erkannt wird (Mobile/Desktop)
+    Zugriffsprüfung erfolgt vorher in AuthMiddleware.
+    format=svg liefert Stimmung/Mahlzeiten als SVG (schneller, Client muss SVG darstellen können).
+    Ergebnisse werden ANALYTICS_CACHE_TTL Sekunden gecacht;
+    "Cache-Control: no-cache" erzwingt eine neue Berechnung.
     """
 
-    # 1️⃣ API-Key prüfen
-    key = request.headers.get("x-api-key")
-    if key != API_KEY:
-        raise HTTPException(status_code=401, detail="Unauthorized: Invalid API key")
-
-    # 2️⃣ Herkunft (Origin) prüfen – für Web-Aufrufe
-    origin = request.headers.get("origin", "")
-    if origin and not any(origin.startswith(o) for o in ALLOWED_ORIGINS):
-        raise HTTPException(status_code=403, detail=f"Forbidden origin: {origin}")
-
-    # 3️⃣ User-Agent prüfen – für native Apps (APK / Windows)
-    agent = request.headers.get("user-agent", "").lower()
-    if origin == "" and not any(re.search(pat.lower(), agent) for pat in TRUSTED_USER_AGENTS):
-        raise HTTPException(status_code=403, detail="Forbidden: Invalid User-Agent")
-
-    # 4️⃣ Analyse starten
+    # Analyse starten
     try:
-        print(f"📊 Starte Analyse für User: {user}")
-        results = generate_analytics_for_user(user)
-
-        # Basis-URL automatisch ermitteln
-        base_url = "https://cedmate-analytics-api.onrender.com"
-        data = {}
+        cache_key = (user, fmt)
+        data = None
+        if request.headers.get("cache-control") != "no-cache":
+            data = _analytics_cache.get(cache_key)
 
-        for k, v in results.items():
-            if v:
-                filename = Path(str(v)).name
-                data[k] = f"{base_url}/output/{filename}"
-            else:
-                data[k] = None
+        if data is None:
+            logger.info("📊 Starte Analyse für User: %s", user)
+            results = await generate_analytics_for_user_async(
+                user, db=request.app.state.async_db, executor=request.app.state.plot_executor, fmt=fmt
+            )
+            # Plotter liefern Pfade in OUTPUT_DIR -> öffentliche URLs (fertig gecacht)
+            data = {k: BASE_OUTPUT_URL + v.name if v else None for k, v in results.items()}
+            _analytics_cache[cache_key] = data
+        else:
+            logger.info("♻️ Cache-Treffer für User: %s", user)
 
-        print(f"✅ Fertig: {data}")
+        logger.info("✅ Fertig: %s", data)
         return {"status": "ok", "user": user, "results": data}
 
     except Exception as e:
-        print(f"⚠️ Fehler bei Analytics für {user}: {e}")
+        logger.exception("⚠️ Fehler bei Analytics für %s", user)
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/analytics/invalidate")
+async def invalidate_analytics(user: str):
+    """
+    Verwirft gecachte Analytics eines Benutzers (z. B. nach neuen Einträgen in der App).
+    Gleiche Sicherheitschecks wie /analytics (AuthMiddleware)
+    """
+    removed = False
+    for fmt in ("png", "svg"):
+        removed |= _analytics_cache.pop((user, fmt), None) is not None
+    return {"status": "ok", "user": user, "invalidated": removed}
+
+
 @app.get("/export")
 async def export_data(request: Request, user: str):
     """
     Exportiert Benutzerdaten + Diagramme als PDF
-    Gleiche Sicherheitschecks wie /analytics
+    Gleiche Sicherheitschecks wie /analytics (AuthMiddleware)
     """
 
-    # API-Key prüfen
-    key = request.headers.get("x-api-key")
-    if key != API_KEY:
-        raise HTTPException(status_code=401, detail="Unauthorized: Invalid API key")
-
-    # Origin prüfen (für Web)
-    origin = request.headers.get("origin", "")
-    if origin and not any(origin.startswith(o) for o in ALLOWED_ORIGINS):
-        raise HTTPException(status_code=403, detail=f"Forbidden origin: {origin}")
-
-    # User-Agent prüfen (für native Apps)
-    agent = request.headers.get("user-agent", "").lower()
-    if origin == "" and not any(re.search(pat.lower(), agent) for pat in TRUSTED_USER_AGENTS):
-        raise HTTPException(status_code=403, detail="Forbidden: Invalid User-Agent")
-
     # Export starten
     try:
-        print(f"📄 Starte Daten-Export für User: {user}")
+        logger.info("📄 Starte Daten-Export für User: %s", user)
 
         # ⬇️ PDF generieren (you create this function next)
-        pdf_path = generate_export_pdf_for_user(user)
+        pdf_path = generate_export_pdf_for_user(user, db=request.app.state.db)
 
-        base_url = "https://cedmate-analytics-api.onrender.com"
-        filename = Path(str(pdf_path)).name
-        pdf_url = f"{base_url}/output/{filename}"
+        pdf_url = BASE_OUTPUT_URL + pdf_path.name
 
-        print(f"📄 Export fertig: {pdf_url}")
+        logger.info("📄 Export fertig: %s", pdf_url)
         return {
             "status": "ok",
             "user": user,
@@ -155,5 +306,5 @@ async def export_data(request: Request, user: str):
         }
 
     except Exception as e:
-        print(f"⚠️ Fehler beim Export für {user}: {e}")
+        logger.exception("⚠️ Fehler beim Export für %s", user)
         raise HTTPException(status_code=500, detail=str(e))
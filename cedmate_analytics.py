@@ -1,17 +1,27 @@
 """
 CEDmate Analytics Plugin – sichere & robuste Variante
 ----------------------------------------------------
-Dieses Skript generiert Diagramme (PNG) für Firestore-Daten eines bestimmten Benutzers.
+Dieses Skript generiert Diagramme (PNG, optional SVG) für Firestore-Daten eines bestimmten Benutzers.
 Es wird von api.py (FastAPI) aufgerufen, kann aber auch lokal über CLI verwendet werden.
 """
 
 import os
 import argparse
+import asyncio
+import datetime
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache
 from pathlib import Path
-import matplotlib.pyplot as plt
+from xml.sax.saxutils import escape
+import numpy as np
 import pandas as pd
-import firebase_admin
-from firebase_admin import credentials, firestore
+
+logger = logging.getLogger(__name__)
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
 
 # -------------------------------------------------------------------
 # Pfade & Initialisierung
@@ -21,190 +31,771 @@ SCRIPT_DIR = Path(__file__).resolve().parent
 SA_PATH = Path(os.getenv("SERVICE_ACCOUNT_PATH", SCRIPT_DIR / "serviceAccount.json"))
 OUTPUT_DIR = SCRIPT_DIR / "output"
 OUTPUT_DIR.mkdir(exist_ok=True)
+# Obergrenze gelesener Dokumente pro Subcollection für die Diagramme (0 = alle): begrenzt
+# Lesekosten und Speicher auch für Collections, die nicht ausgedünnt werden (Stimmung, Mahlzeiten).
+# Ohne order_by sind das beliebige Dokumente (nach ID), nicht die neuesten; erst weit jenseits
+# normaler Nutzung erreicht. Der PDF-Export liest immer alles.
+MAX_DOCS = int(os.getenv("MAX_DOCS_PER_COLLECTION", "50000"))
+# Fortschritts-Log (debug) alle n gestreamten Dokumente
+LOG_EVERY_DOCS = 500
+# Dokumente pro Firestore-Seite (Cursor-Paginierung statt eines einzigen langen Streams)
+FETCH_PAGE_SIZE = 1000
+# Höchstens so viele Punkte pro Scatter-Plot (mehr sind bei 1000x500 px nicht unterscheidbar)
+SCATTER_MAX_POINTS = 10_000
+# Scatter-Collections werden schon beim Streamen auf SCATTER_MAX_POINTS Zeilen ausgedünnt,
+# damit nie mehr als diese Zeilen im Speicher liegen (Tageszählung/Linie brauchen alle Punkte)
+THIN_ON_FETCH = {"stuhlgaenge": SCATTER_MAX_POINTS, "symptoms": SCATTER_MAX_POINTS}
+# Prozesse fürs parallele Plotten in der API (0 = im Worker-Thread nacheinander).
+# Jeder Worker belegt nach dem ersten Plot ~110 MB und lädt pandas/matplotlib beim ersten
+# Request neu; auf dem Render-Free-Plan (512 MB) deshalb standardmäßig aus.
+PLOT_WORKERS = int(os.getenv("PLOT_WORKERS", "0"))
 
 # -------------------------------------------------------------------
 # Firestore-Verbindung
 # -------------------------------------------------------------------
-def connect_firestore(service_account_path: str | None = None):
-    """Initialisiert Firestore mit dem Service-Account."""
-    sa_path = Path(service_account_path) if service_account_path else SA_PATH
+def get_db(service_account_path: str | None = None):
+    """
+    Initialisiert Firestore mit dem Service-Account.
+    Der Client wird gecacht, damit Zertifikat und Client nur einmal pro Prozess erzeugt werden.
+    """
+    # Cache-Schlüssel ist der aufgelöste Pfad: get_db(), get_db(None) und get_db(str(SA_PATH))
+    # teilen sich einen Client
+    return _client_for(_sa_path(service_account_path))
+
+
+def get_async_db(service_account_path: str | None = None):
+    """
+    Firestore-AsyncClient für die API (firebase_admin hält ihn pro App vor).
+    Sein gRPC-Kanal gehört zum Event-Loop, in dem er zuerst benutzt wird:
+    einmal im Lifespan der App erzeugen, nicht über mehrere asyncio.run-Aufrufe teilen.
+    """
+    _init_firebase(_sa_path(service_account_path))
+    from firebase_admin import firestore_async
+    return firestore_async.client()
+
+
+def _sa_path(service_account_path: str | None) -> Path:
+    return (Path(service_account_path) if service_account_path else SA_PATH).resolve()
+
+
+@lru_cache(maxsize=4)
+def _client_for(sa_path: Path):
+    _init_firebase(sa_path)
+    from firebase_admin import firestore
+    return firestore.client()
+
+
+def _init_firebase(sa_path: Path):
     if not sa_path.exists():
         raise FileNotFoundError(
             f"serviceAccount.json nicht gefunden unter: {sa_path}\n"
             f"Bitte Datei als Secret File bei Render hinterlegen oder lokal im Ordner ablegen."
         )
 
-    cred = credentials.Certificate(str(sa_path))
+    # Erst hier importiert: kostet beim Kaltstart sonst unnötig Zeit/Speicher
+    import firebase_admin
+    from firebase_admin import credentials
+
     try:
         firebase_admin.get_app()
     except ValueError:
-        firebase_admin.initialize_app(cred)
-    return firestore.client()
+        # Zertifikat nur parsen, wenn die App wirklich neu initialisiert wird
+        firebase_admin.initialize_app(credentials.Certificate(str(sa_path)))
 
 # -------------------------------------------------------------------
 # Hilfsfunktionen
 # -------------------------------------------------------------------
-def _convert_firestore_timestamps(entry: dict):
-    for k, v in list(entry.items()):
-        if hasattr(v, "to_datetime"):
-            entry[k] = v.to_datetime()
-    return entry
+# Namens-Heuristik für Zeitspalten (Reihenfolge = Priorität)
+TIME_NAME_ORDER = ["zeit", "time", "datum", "date", "timestamp", "startzeit", "endzeit",
+                   "mahlzeitzeitpunkt"]
+# Werte-Spalten je Diagramm (Reihenfolge = Priorität)
+STUHLGANG_VALUE_COLS = ["konsistenz", "bristol", "typ", "score", "wert", "level",
+                        "intensitaet", "intensität", "staerke", "stärke"]
+STIMMUNG_VALUE_COLS = ["wert", "score", "level", "stimmung"]
+SYMPTOM_VALUE_COLS = ["intensitaet", "intensität", "staerke", "stärke", "wert", "score",
+                      "level", "schmerz", "severity"]
+
+# Firestore-Feldprojektion für die Diagramme: nur Zeit- und Werte-Felder werden übertragen.
+# Feldnamen sind in Firestore case-sensitiv, die Heuristik nicht: deshalb alle Namen aus
+# TIME_NAME_ORDER plus die in der App üblichen camelCase-Schreibweisen.
+TIME_FIELD_ALIASES = ["zeitpunkt", "startZeit", "endZeit", "mahlzeitZeitpunkt", "createdAt"]
+TIME_FIELDS = TIME_NAME_ORDER + TIME_FIELD_ALIASES
+# Werte-Spalten je Subcollection (None = Diagramm braucht nur die Zeit)
+PLOT_VALUE_COLS = {
+    "stuhlgaenge": STUHLGANG_VALUE_COLS,
+    "stimmungen": STIMMUNG_VALUE_COLS,
+    "symptoms": SYMPTOM_VALUE_COLS,
+    "mahlzeiten": None,
+}
+PLOT_FIELDS = {name: TIME_FIELDS + (cols or []) for name, cols in PLOT_VALUE_COLS.items()}
+# Zeilen, an denen die Parsebarkeit einer Kandidatenspalte getestet wird, und der Anteil,
+# der davon parsen muss (pandas leitet das Format vom ersten Wert ab; bei gemischten
+# Formaten würde sonst der Großteil der Spalte still zu NaT)
+DETECT_SAMPLE_ROWS = 32
+DETECT_MIN_PARSED = 0.5
+
+
+# Erkannte Spalten werden in df.attrs gemerkt, damit derselbe Frame (z. B. erneut
+# geplottet) nicht noch einmal gescannt und geparst wird
+_DETECTED_ATTR = "cedmate_detected"
+
+
+def _detected(df: pd.DataFrame) -> dict:
+    return df.attrs.setdefault(_DETECTED_ATTR, {})
 
 
 def _detect_time_col(df: pd.DataFrame) -> str | None:
-    dt_cols = [c for c in df.columns if pd.api.types.is_datetime64_any_dtype(df[c])]
-    if dt_cols:
-        return dt_cols[0]
-    name_order = ["zeit", "time", "datum", "date", "timestamp", "startzeit", "endzeit",
-                  "mahlzeitzeitpunkt"]
-    for key in name_order:
-        cand = [c for c in df.columns if key in c.lower()]
-        if cand:
-            try:
-                df[cand[0]] = pd.to_datetime(df[cand[0]])
-                return cand[0]
-            except Exception:
-                continue
+    cached = _detected(df).get("time")
+    if cached in df.columns and pd.api.types.is_datetime64_any_dtype(df[cached].dtype):
+        return cached
+    col = _scan_time_col(df)
+    _detected(df)["time"] = col
+    return col
+
+
+def _scan_time_col(df: pd.DataFrame) -> str | None:
+    dtype_map = df.dtypes.to_dict()
+    for col, dtype in dtype_map.items():
+        if pd.api.types.is_datetime64_any_dtype(dtype):
+            return col
+    lowered = {col: str(col).lower() for col in dtype_map}
+    for key in TIME_NAME_ORDER:
+        cand = next((col for col, low in lowered.items() if key in low), None)
+        if cand is None:
+            continue
+        # Erst an einer kleinen Stichprobe prüfen, dann die ganze Spalte konvertieren.
+        # utc=True wie in _datetime_cols_to_utc: Strings mit gemischten Offsets blieben sonst object
+        sample = df[cand].dropna().head(DETECT_SAMPLE_ROWS)
+        if sample.empty:
+            continue
+        parsed = pd.to_datetime(sample, errors="coerce", utc=True)
+        if parsed.notna().mean() < DETECT_MIN_PARSED:
+            continue
+        converted = pd.to_datetime(df[cand], errors="coerce", utc=True)
+        if pd.api.types.is_datetime64_any_dtype(converted):
+            df[cand] = converted
+            return cand
     return None
 
 
 def _detect_value_col(df: pd.DataFrame, preference: list[str]) -> str | None:
+    key = ("value", tuple(preference))
+    detected = _detected(df)
+    cached = detected.get(key)
+    if cached in df.columns and pd.api.types.is_numeric_dtype(df[cached].dtype):
+        return cached
+    col = _scan_value_col(df, preference)
+    detected[key] = col
+    return col
+
+
+def _scan_value_col(df: pd.DataFrame, preference: list[str]) -> str | None:
+    numeric = {}
+    for col, dtype in df.dtypes.items():
+        if pd.api.types.is_numeric_dtype(dtype):
+            numeric.setdefault(str(col).lower(), col)
     for name in preference:
-        cols = [c for c in df.columns if name == c.lower()]
-        if cols and pd.api.types.is_numeric_dtype(df[cols[0]]):
-            return cols[0]
-    num_cols = [c for c in df.columns if pd.api.types.is_numeric_dtype(df[c])]
-    return num_cols[0] if num_cols else None
-
-
-def _df_from_user_subcollection(db, user_id: str, subcollection: str) -> pd.DataFrame:
-    user_ref = db.collection("users").document(user_id)
-    docs = user_ref.collection(subcollection).get()
-    rows = []
-    for d in docs:
-        entry = d.to_dict() or {}
-        entry["id"] = d.id
-        rows.append(_convert_firestore_timestamps(entry))
-    df = pd.DataFrame(rows) if rows else pd.DataFrame()
-    print(f"Fetched {len(df)} docs from users/{user_id}/{subcollection}")
+        if name in numeric:
+            return numeric[name]
+    return next(iter(numeric.values()), None)
+
+
+class _ColumnSink:
+    """
+    Sammelt gestreamte Dokumente spaltenweise (SoA); fehlende Felder werden mit None aufgefüllt.
+    Mit `max_rows` wird gleichmäßig ausgedünnt, sobald mehr Zeilen anfallen: jede zweite
+    gespeicherte Zeile fällt weg und danach wird nur noch jedes 2., 4., ... Dokument übernommen.
+    So bleiben höchstens `max_rows` Zeilen im Speicher, verteilt über die ganze Collection.
+    """
+
+    def __init__(self, max_rows: int | None = None):
+        self.max_rows = max_rows
+        self.seen = 0
+        self.stride = 1
+        self.ids: list = []
+        self.columns: dict[str, list] = {}
+
+    def add(self, d) -> None:
+        self.seen += 1
+        if (self.seen - 1) % self.stride:
+            return
+        i = len(self.ids)
+        self.ids.append(d.id)
+        for key, value in (d.to_dict() or {}).items():
+            col = self.columns.setdefault(key, [])
+            if len(col) < i:
+                col.extend([None] * (i - len(col)))
+            col.append(value)
+        if self.max_rows and len(self.ids) > self.max_rows:
+            self._halve()
+
+    def _halve(self) -> None:
+        self._pad()
+        self.ids = self.ids[::2]
+        self.columns = {key: col[::2] for key, col in self.columns.items()}
+        self.stride *= 2
+
+    def _pad(self) -> None:
+        for col in self.columns.values():
+            col.extend([None] * (len(self.ids) - len(col)))
+
+    def to_df(self) -> pd.DataFrame:
+        """
+        Baut den Frame einmal aus allen Spalten, damit jede Spalte einen dtype über alle
+        Dokumente bekommt (z. B. float64 statt object, wenn ein Wert lange Strecken fehlt).
+        """
+        if not self.ids:
+            return pd.DataFrame()
+        self._pad()
+        return _datetime_cols_to_utc(pd.DataFrame({**self.columns, "id": self.ids}))
+
+
+def _datetime_cols_to_utc(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Timestamps mit gemischten Offsets bleiben beim DataFrame-Bau object-Spalten.
+    Solche Spalten werden hier einmal pro Spalte (statt pro Wert) nach UTC konvertiert.
+    """
+    for col in df.columns[df.dtypes == object]:
+        first = df[col].first_valid_index()
+        if first is not None and isinstance(df[col].at[first], datetime.datetime):
+            df[col] = pd.to_datetime(df[col], utc=True, errors="coerce")
+    return df
+
+
+def _subcollection_query(db, user_id: str, subcollection: str, fields: list[str] | None):
+    # Gleicher Aufbau für Client und AsyncClient
+    query = db.collection("users").document(user_id).collection(subcollection)
+    if fields:
+        # select() erwartet Feldpfade: Namen wie "intensität" müssen in Backticks stehen
+        from google.cloud.firestore_v1.field_path import FieldPath
+        query = query.select([FieldPath(name).to_api_repr() for name in fields])
+    return query
+
+
+def _page_query(query, remaining: int | None, cursor):
+    """Query für die nächste Seite (limit + start_after) und deren Größe."""
+    size = FETCH_PAGE_SIZE if remaining is None else min(FETCH_PAGE_SIZE, remaining)
+    page = query.limit(size)
+    return (page if cursor is None else page.start_after(cursor)), size
+
+
+def _iter_paged_docs(query, limit: int | None):
+    """
+    Liest die Query seitenweise statt als einen langen Stream (der bei großen Collections
+    in die gRPC-Deadline laufen kann); höchstens `limit` Dokumente (None/0 = alle).
+    """
+    remaining = limit or None
+    cursor = None
+    while remaining is None or remaining > 0:
+        page, size = _page_query(query, remaining, cursor)
+        count = 0
+        for cursor in page.stream():
+            count += 1
+            yield cursor
+        if count < size:
+            return
+        if remaining is not None:
+            remaining -= count
+
+
+async def _aiter_paged_docs(query, limit: int | None):
+    """_iter_paged_docs für den AsyncClient."""
+    remaining = limit or None
+    cursor = None
+    while remaining is None or remaining > 0:
+        page, size = _page_query(query, remaining, cursor)
+        count = 0
+        async for cursor in page.stream():
+            count += 1
+            yield cursor
+        if count < size:
+            return
+        if remaining is not None:
+            remaining -= count
+
+
+def _downcast_numeric(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Zahlen kommen als int64/float64; Werte-Skalen (1–10, Bristol 1–7) passen in kleinere Typen.
+    float32 ist verlustbehaftet: nur für Diagramm-Daten, nicht für den Export.
+    """
+    for col in df.select_dtypes("int64").columns:
+        df[col] = pd.to_numeric(df[col], downcast="integer")
+    for col in df.select_dtypes("float64").columns:
+        df[col] = pd.to_numeric(df[col], downcast="float")
     return df
 
+
+def _df_from_user_subcollection(db, user_id: str, subcollection: str,
+                                fields: list[str] | None = None,
+                                limit: int | None = None,
+                                max_rows: int | None = None) -> pd.DataFrame:
+    # Firestore-Timestamps kommen als DatetimeWithNanoseconds (datetime-Subklasse) an,
+    # die pandas direkt als Zeitspalte erkennt.
+    query = _subcollection_query(db, user_id, subcollection, fields)
+    # Dokumente werden beim Eintreffen verarbeitet; Fortschritt über einen Zähler,
+    # damit lange Collections schon während des Streams sichtbar sind.
+    sink = _ColumnSink(max_rows)
+    for d in _iter_paged_docs(query, limit):
+        sink.add(d)
+        if sink.seen % LOG_EVERY_DOCS == 0:
+            logger.debug("… %s docs from users/%s/%s", sink.seen, user_id, subcollection)
+    _log_fetched(sink, user_id, subcollection)
+    return sink.to_df()
+
+
+async def _df_from_user_subcollection_async(db, user_id: str, subcollection: str,
+                                            fields: list[str] | None = None,
+                                            limit: int | None = None,
+                                            max_rows: int | None = None) -> pd.DataFrame:
+    """Wie _df_from_user_subcollection, aber über den AsyncClient (kein Worker-Thread)."""
+    query = _subcollection_query(db, user_id, subcollection, fields)
+    sink = _ColumnSink(max_rows)
+    async for d in _aiter_paged_docs(query, limit):
+        sink.add(d)
+        if sink.seen % LOG_EVERY_DOCS == 0:
+            logger.debug("… %s docs from users/%s/%s", sink.seen, user_id, subcollection)
+    _log_fetched(sink, user_id, subcollection)
+    return sink.to_df()
+
+
+def _log_fetched(sink: _ColumnSink, user_id: str, subcollection: str) -> None:
+    if sink.stride > 1:
+        logger.info("Fetched %s docs from users/%s/%s, kept %s", sink.seen, user_id,
+                    subcollection, len(sink.ids))
+    else:
+        logger.info("Fetched %s docs from users/%s/%s", sink.seen, user_id, subcollection)
+
 # -------------------------------------------------------------------
 # Fetch Layer
 # -------------------------------------------------------------------
-def fetch_for_user(db, collection_name: str, user_id: str) -> pd.DataFrame:
-    """Holt Daten aus users/<userId>/<collection_name>."""
-    return _df_from_user_subcollection(db, user_id, collection_name)
+def fetch_for_user(db, collection_name: str, user_id: str,
+                   fields: list[str] | None = None, limit: int | None = None) -> pd.DataFrame:
+    """
+    Holt Daten aus users/<userId>/<collection_name> (ohne `limit` alle Dokumente).
+    Mit `fields` werden nur diese Felder übertragen (serverseitige Projektion).
+    """
+    return _df_from_user_subcollection(db, user_id, collection_name, fields, limit)
+
+
+def _plot_columns_found(df: pd.DataFrame, collection_name: str) -> bool:
+    """
+    False, wenn die Heuristik im projizierten Frame Zeit- oder Werte-Spalte nicht findet.
+    Dann greifen die Fallbacks "beliebige Datums-/erste Zahlenspalte" nur auf den
+    vollständigen Dokumenten (zweiter, voll abgerechneter Fetch: bekannte Namen gehören
+    deshalb in PLOT_FIELDS).
+    """
+    if df.empty:
+        return True  # keine Dokumente: ein vollständiger Fetch fände auch keine
+    if _detect_time_col(df) is None:
+        return False
+    value_cols = PLOT_VALUE_COLS.get(collection_name)
+    return value_cols is None or _detect_value_col(df, value_cols) is not None
+
+
+def fetch_plot_data(db, collection_name: str, user_id: str) -> pd.DataFrame:
+    """
+    Holt nur die für die Diagramme benötigten Felder (PLOT_FIELDS);
+    ohne erkennbare Zeit-/Wertespalte wird die Collection vollständig geladen.
+    """
+    max_rows = THIN_ON_FETCH.get(collection_name)
+    df = _df_from_user_subcollection(db, user_id, collection_name,
+                                     PLOT_FIELDS.get(collection_name), MAX_DOCS, max_rows)
+    if not _plot_columns_found(df, collection_name):
+        logger.warning("Projection missed plot fields in users/%s/%s, fetching full documents",
+                       user_id, collection_name)
+        df = _df_from_user_subcollection(db, user_id, collection_name,
+                                         limit=MAX_DOCS, max_rows=max_rows)
+    return _downcast_numeric(df)
+
+
+async def fetch_plot_data_async(db, collection_name: str, user_id: str) -> pd.DataFrame:
+    """fetch_plot_data für den AsyncClient (get_async_db)."""
+    max_rows = THIN_ON_FETCH.get(collection_name)
+    df = await _df_from_user_subcollection_async(db, user_id, collection_name,
+                                                 PLOT_FIELDS.get(collection_name), MAX_DOCS,
+                                                 max_rows)
+    if not _plot_columns_found(df, collection_name):
+        logger.warning("Projection missed plot fields in users/%s/%s, fetching full documents",
+                       user_id, collection_name)
+        df = await _df_from_user_subcollection_async(db, user_id, collection_name,
+                                                     limit=MAX_DOCS, max_rows=max_rows)
+    return _downcast_numeric(df)
 
 # -------------------------------------------------------------------
 # Plotter
 # -------------------------------------------------------------------
-def plot_stuhlgang(df: pd.DataFrame, user_id: str):
+@lru_cache(maxsize=10000)
+def output_paths(user_id: str) -> dict[str, Path]:
+    """Alle Ausgabedateien eines Users, einmal pro User berechnet (Dateinamen sind fix)."""
+    return {
+        "stuhlgang": OUTPUT_DIR / f"stuhlgang_scatter_{user_id}.png",
+        "stimmung": OUTPUT_DIR / f"stimmung_line_{user_id}.png",
+        "stimmung_svg": OUTPUT_DIR / f"stimmung_line_{user_id}.svg",
+        "symptome": OUTPUT_DIR / f"symptome_scatter_{user_id}.png",
+        "mahlzeit": OUTPUT_DIR / f"mahlzeiten_bars_{user_id}.png",
+        "mahlzeit_svg": OUTPUT_DIR / f"mahlzeiten_bars_{user_id}.svg",
+        "export": OUTPUT_DIR / f"export_{user_id}.pdf",
+    }
+
+# Eine Figure für alle Diagramme statt einer neuen pro Plot, erzeugt beim ersten Plot
+# (matplotlib wird erst dann importiert); Zugriff über _PLOT_LOCK serialisiert.
+_FIG = None
+_AX = None
+# Gleiches Prinzip für die Diagrammseiten des PDF-Exports, aber im Seitenformat A4
+_PDF_FIG = None
+_PDF_AX = None
+_PLOT_LOCK = threading.Lock()
+# Flächige Linien-/Balkendiagramme: schwächere zlib-Stufe spart ~30 % Schreibzeit
+# bei ~15 % größeren Dateien
+PNG_SAVE_OPTIONS = {"compress_level": 3, "optimize": False}
+# Export-Seiten: A4 hochkant (Zoll); das Diagramm sitzt im oberen Teil der Seite
+# (links, unten, Breite, Höhe als Anteile der Seite, unten Platz für gedrehte Datumslabels)
+A4_FIGSIZE = (8.27, 11.69)
+PDF_PLOT_RECT = (0.12, 0.55, 0.80, 0.35)
+
+
+def _agg_figure(figsize):
+    import matplotlib
+    matplotlib.use("Agg")  # kein GUI-Backend auf dem Server
+    from matplotlib.figure import Figure
+
+    # dpi fest, damit eine matplotlibrc die PNG-Größe (1000x500) nicht verändert
+    return Figure(figsize=figsize, dpi=100)
+
+
+def _shared_axes(pdf_page: bool = False):
+    global _FIG, _AX, _PDF_FIG, _PDF_AX
+    if pdf_page:
+        if _PDF_AX is None:
+            _PDF_FIG = _agg_figure(A4_FIGSIZE)
+            _PDF_AX = _PDF_FIG.add_axes(PDF_PLOT_RECT)
+        return _PDF_FIG, _PDF_AX
+    if _AX is None:
+        _FIG = _agg_figure((10, 5))
+        _AX = _FIG.add_subplot()
+    return _FIG, _AX
+
+
+@contextmanager
+def _reused_axes(target):
+    """
+    Leert die gemeinsame Achse, lässt den Aufrufer zeichnen und speichert nach target:
+    ein Pfad (PNG, 10x5 Zoll) oder ein offenes PdfPages, in das eine A4-Seite mit dem
+    Diagramm als Vektorgrafik geht.
+    """
+    as_png = isinstance(target, Path)
+    with _PLOT_LOCK:
+        fig, ax = _shared_axes(pdf_page=not as_png)
+        ax.clear()
+        yield ax
+        if as_png:
+            fig.tight_layout()
+            fig.savefig(target, bbox_inches=None, pil_kwargs=PNG_SAVE_OPTIONS)
+        else:
+            target.savefig(fig, bbox_inches=None)
+
+def _thin(df: pd.DataFrame, max_points: int = SCATTER_MAX_POINTS) -> pd.DataFrame:
+    """Gleichmäßig ausgedünnt auf höchstens max_points Zeilen (jede n-te Zeile)."""
+    step = -(-len(df) // max_points)
+    return df.iloc[::step] if step > 1 else df
+
+
+def plot_stuhlgang(df: pd.DataFrame, user_id: str, pdf=None):
     if df.empty:
-        print(f"No stuhlgang entries for '{user_id}'.")
+        logger.info("No stuhlgang entries for '%s'.", user_id)
         return None
     tcol = _detect_time_col(df)
-    vcol = _detect_value_col(df,
-                             ["konsistenz", "bristol", "typ", "score", "wert", "level",
-                              "intensitaet", "intensität", "staerke", "stärke"])
+    vcol = _detect_value_col(df, STUHLGANG_VALUE_COLS)
     if not tcol or not vcol:
         return None
-    out_path = OUTPUT_DIR / f"stuhlgang_scatter_{user_id}.png"
-    plt.figure(figsize=(10, 5))
-    plt.scatter(df[tcol], df[vcol], c=df[vcol])
-    plt.xlabel("Zeit")
-    plt.ylabel(vcol)
-    plt.title(f"Stuhlgang – {user_id}")
-    plt.tight_layout()
-    plt.savefig(out_path)
-    plt.close()
-    return out_path
+    target = pdf if pdf is not None else output_paths(user_id)["stuhlgang"]
+    with _reused_axes(target) as ax:
+        points = _thin(df)
+        ax.scatter(points[tcol], points[vcol])
+        ax.set_xlabel("Zeit")
+        ax.set_ylabel(vcol)
+        ax.set_title(f"Stuhlgang – {user_id}")
+    return target
 
 
-def plot_stimmung(df: pd.DataFrame, user_id: str):
+def _prepare_stimmung(df: pd.DataFrame, user_id: str):
+    """Gibt (sortiertes df, Zeitspalte, Wertespalte) zurück oder None."""
     if df.empty:
-        print(f"No stimmung entries for '{user_id}'.")
+        logger.info("No stimmung entries for '%s'.", user_id)
         return None
     tcol = _detect_time_col(df)
-    vcol = _detect_value_col(df, ["wert", "score", "level"])
+    vcol = _detect_value_col(df, STIMMUNG_VALUE_COLS)
     if not tcol or not vcol:
         return None
-    df = df.sort_values(tcol)
-    out_path = OUTPUT_DIR / f"stimmung_line_{user_id}.png"
-    plt.figure(figsize=(10, 5))
-    plt.plot(df[tcol], df[vcol])
-    plt.xlabel("Zeit")
-    plt.ylabel("Stimmungswert")
-    plt.title(f"Stimmung – {user_id}")
-    plt.tight_layout()
-    plt.savefig(out_path)
-    plt.close()
-    return out_path
+    # Firestore liefert ohne order_by nach Dokument-ID; oft ist das schon chronologisch
+    if not df[tcol].is_monotonic_increasing:
+        df = df.sort_values(tcol)
+    return df, tcol, vcol
+
+
+def plot_stimmung(df: pd.DataFrame, user_id: str, pdf=None):
+    prepared = _prepare_stimmung(df, user_id)
+    if prepared is None:
+        return None
+    df, tcol, vcol = prepared
+    target = pdf if pdf is not None else output_paths(user_id)["stimmung"]
+    with _reused_axes(target) as ax:
+        ax.plot(df[tcol], df[vcol])
+        ax.set_xlabel("Zeit")
+        ax.set_ylabel("Stimmungswert")
+        ax.set_title(f"Stimmung – {user_id}")
+    return target
 
 
-def plot_symptome(df: pd.DataFrame, user_id: str):
+def plot_symptome(df: pd.DataFrame, user_id: str, pdf=None):
     if df.empty:
-        print(f"No symptome entries for '{user_id}'.")
+        logger.info("No symptome entries for '%s'.", user_id)
         return None
     tcol = _detect_time_col(df)
-    vcol = _detect_value_col(df,
-                             ["intensitaet", "intensität", "staerke", "stärke", "wert", "score",
-                              "level", "schmerz", "severity"])
+    vcol = _detect_value_col(df, SYMPTOM_VALUE_COLS)
     if not tcol or not vcol:
         return None
-    out_path = OUTPUT_DIR / f"symptome_scatter_{user_id}.png"
-    plt.figure(figsize=(10, 5))
-    plt.scatter(df[tcol], df[vcol], c=df[vcol])
-    plt.xlabel("Zeit")
-    plt.ylabel("Symptomstärke")
-    plt.title(f"Symptome – {user_id}")
-    plt.tight_layout()
-    plt.savefig(out_path)
-    plt.close()
-    return out_path
+    target = pdf if pdf is not None else output_paths(user_id)["symptome"]
+    with _reused_axes(target) as ax:
+        points = _thin(df)
+        ax.scatter(points[tcol], points[vcol])
+        ax.set_xlabel("Zeit")
+        ax.set_ylabel("Symptomstärke")
+        ax.set_title(f"Symptome – {user_id}")
+    return target
 
 
-def plot_mahlzeit(df: pd.DataFrame, user_id: str):
+def _meals_per_day(df: pd.DataFrame, user_id: str) -> pd.Series | None:
+    """Anzahl Mahlzeiten pro Kalendertag oder None."""
     if df.empty:
-        print(f"No mahlzeiten entries for '{user_id}'.")
+        logger.info("No mahlzeiten entries for '%s'.", user_id)
         return None
     tcol = _detect_time_col(df)
     if not tcol:
         return None
-    df[tcol] = pd.to_datetime(df[tcol], errors='coerce')
-    df = df.dropna(subset=[tcol])
-    df["datum"] = df[tcol].dt.date
-    counts = df.groupby("datum").size()
-    if counts.empty:
+    times = df[tcol].dropna()  # _detect_time_col liefert die Spalte bereits als datetime64
+    if times.empty:
+        return None
+    if times.dt.tz is not None:
+        times = times.dt.tz_localize(None)  # Kalendertag in UTC (Zeitspalten sind UTC)
+    # Tage als int64 seit Epoche zählen statt groupby über datetime.date-Objekte
+    days = times.to_numpy().astype("datetime64[D]").astype(np.int64)
+    first = days.min()
+    per_day = np.bincount(days - first)
+    offsets = np.flatnonzero(per_day)  # nur Tage mit Einträgen, wie bisher
+    dates = (first + offsets).astype("datetime64[D]").astype(object)
+    return pd.Series(per_day[offsets], index=pd.Index(dates, name="datum"))
+
+
+def plot_mahlzeit(df: pd.DataFrame, user_id: str, pdf=None):
+    counts = _meals_per_day(df, user_id)
+    if counts is None:
         return None
-    out_path = OUTPUT_DIR / f"mahlzeiten_bars_{user_id}.png"
-    plt.figure(figsize=(10, 5))
-    counts.plot(kind="bar", color="cornflowerblue", edgecolor="black")
-    plt.xlabel("Datum")
-    plt.ylabel("Anzahl Mahlzeiten")
-    plt.title(f"Mahlzeiten pro Tag – {user_id}")
-    plt.tight_layout()
-    plt.savefig(out_path)
-    plt.close()
+    target = pdf if pdf is not None else output_paths(user_id)["mahlzeit"]
+    with _reused_axes(target) as ax:
+        counts.plot(kind="bar", ax=ax, color="cornflowerblue", edgecolor="black")
+        ax.set_xlabel("Datum")
+        ax.set_ylabel("Anzahl Mahlzeiten")
+        ax.set_title(f"Mahlzeiten pro Tag – {user_id}")
+    return target
+
+# -------------------------------------------------------------------
+# SVG-Schnellpfad (ohne matplotlib) für Linien- und Balkendiagramm
+# -------------------------------------------------------------------
+SVG_WIDTH, SVG_HEIGHT = 1000, 500
+# Zeichenfläche innerhalb der Ränder (links, oben, rechts, unten)
+_SVG_X0, _SVG_Y0, _SVG_X1, _SVG_Y1 = 70, 40, SVG_WIDTH - 20, SVG_HEIGHT - 90
+
+
+def _svg_y(values, lo: float, hi: float):
+    span = (hi - lo) or 1
+    return _SVG_Y1 - (values - lo) / span * (_SVG_Y1 - _SVG_Y0)
+
+
+def _write_svg(out_path: Path, title: str, xlabel: str, ylabel: str,
+               y_lo: float, y_hi: float, x_ticks: list[tuple[float, str]],
+               body: list[str], rotate_x_labels: bool = False) -> Path:
+    """Schreibt Rahmen, Achsen, Ticks und Beschriftungen um die Datenelemente in body."""
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{SVG_WIDTH}" height="{SVG_HEIGHT}" '
+        f'viewBox="0 0 {SVG_WIDTH} {SVG_HEIGHT}" font-family="DejaVu Sans, sans-serif" font-size="12">',
+        f'<rect width="{SVG_WIDTH}" height="{SVG_HEIGHT}" fill="white"/>',
+        f'<text x="{SVG_WIDTH / 2}" y="24" text-anchor="middle" font-size="16">{escape(title)}</text>',
+    ]
+    for value in np.linspace(y_lo, y_hi, 6):
+        y = _svg_y(value, y_lo, y_hi)
+        parts.append(f'<line x1="{_SVG_X0 - 4}" y1="{y:.1f}" x2="{_SVG_X0}" y2="{y:.1f}" stroke="black"/>')
+        parts.append(f'<text x="{_SVG_X0 - 7}" y="{y + 4:.1f}" text-anchor="end">{value:g}</text>')
+    for x, label in x_ticks:
+        parts.append(f'<line x1="{x:.1f}" y1="{_SVG_Y1}" x2="{x:.1f}" y2="{_SVG_Y1 + 4}" stroke="black"/>')
+        if rotate_x_labels:
+            parts.append(f'<text x="{x:.1f}" y="{_SVG_Y1 + 8}" text-anchor="end" '
+                         f'transform="rotate(-90 {x:.1f} {_SVG_Y1 + 8})" dy="4">{escape(label)}</text>')
+        else:
+            parts.append(f'<text x="{x:.1f}" y="{_SVG_Y1 + 18}" text-anchor="middle">{escape(label)}</text>')
+    parts.extend(body)
+    parts += [
+        f'<rect x="{_SVG_X0}" y="{_SVG_Y0}" width="{_SVG_X1 - _SVG_X0}" height="{_SVG_Y1 - _SVG_Y0}" '
+        f'fill="none" stroke="black"/>',
+        f'<text x="{(_SVG_X0 + _SVG_X1) / 2}" y="{SVG_HEIGHT - 8}" text-anchor="middle">{escape(xlabel)}</text>',
+        f'<text x="18" y="{(_SVG_Y0 + _SVG_Y1) / 2}" text-anchor="middle" '
+        f'transform="rotate(-90 18 {(_SVG_Y0 + _SVG_Y1) / 2})">{escape(ylabel)}</text>',
+        "</svg>",
+    ]
+    out_path.write_text("\n".join(parts), encoding="utf-8")
     return out_path
 
+
+def plot_stimmung_svg(df: pd.DataFrame, user_id: str):
+    prepared = _prepare_stimmung(df, user_id)
+    if prepared is None:
+        return None
+    df, tcol, vcol = prepared
+    df = df.dropna(subset=[tcol, vcol])
+    if df.empty:
+        return None
+    times, values = df[tcol], df[vcol].to_numpy(dtype=float)
+    t_min, t_span = times.min(), times.max() - times.min()
+    seconds = (times - t_min).dt.total_seconds().to_numpy()
+    total = t_span.total_seconds() or 1
+    xs = _SVG_X0 + seconds / total * (_SVG_X1 - _SVG_X0)
+    y_lo, y_hi = float(values.min()), float(values.max())
+    if y_hi == y_lo:
+        y_lo, y_hi = y_lo - 1, y_hi + 1
+    ys = _svg_y(values, y_lo, y_hi)
+    points = " ".join([f"{x:.1f},{y:.1f}" for x, y in zip(xs, ys)])
+    x_ticks = [(_SVG_X0 + i / 5 * (_SVG_X1 - _SVG_X0), (t_min + t_span * i / 5).strftime("%Y-%m-%d"))
+               for i in range(6)]
+    out_path = output_paths(user_id)["stimmung_svg"]
+    return _write_svg(out_path, f"Stimmung – {user_id}", "Zeit", "Stimmungswert", y_lo, y_hi, x_ticks,
+                      [f'<polyline points="{points}" fill="none" stroke="#1f77b4" stroke-width="1.5"/>'])
+
+
+def plot_mahlzeit_svg(df: pd.DataFrame, user_id: str):
+    counts = _meals_per_day(df, user_id)
+    if counts is None:
+        return None
+    n = len(counts)
+    slot = (_SVG_X1 - _SVG_X0) / n
+    y_hi = float(counts.max())
+    tops = _svg_y(counts.to_numpy(dtype=float), 0, y_hi)
+    bars = [f'<rect x="{_SVG_X0 + slot * (i + 0.25):.1f}" y="{top:.1f}" width="{slot * 0.5:.1f}" '
+            f'height="{_SVG_Y1 - top:.1f}" fill="cornflowerblue" stroke="black"/>'
+            for i, top in enumerate(tops)]
+    step = -(-n // 40)  # höchstens ~40 Datumslabels
+    x_ticks = [(_SVG_X0 + slot * (i + 0.5), str(day)) for i, day in enumerate(counts.index)][::step]
+    out_path = output_paths(user_id)["mahlzeit_svg"]
+    return _write_svg(out_path, f"Mahlzeiten pro Tag – {user_id}", "Datum", "Anzahl Mahlzeiten",
+                      0, y_hi, x_ticks, bars, rotate_x_labels=True)
+
 # -------------------------------------------------------------------
 # Hauptfunktion
 # -------------------------------------------------------------------
-def generate_analytics_for_user(user_id: str, service_account: str | None = None):
-    db = connect_firestore(service_account)
-    data = {
-        "stuhlgang": fetch_for_user(db, "stuhlgaenge", user_id),
-        "stimmung": fetch_for_user(db, "stimmungen", user_id),
-        "symptome": fetch_for_user(db, "symptoms", user_id),
-        "mahlzeit": fetch_for_user(db, "mahlzeiten", user_id),
-    }
-    return {
-        "stuhlgang": plot_stuhlgang(data["stuhlgang"], user_id),
-        "stimmung": plot_stimmung(data["stimmung"], user_id),
-        "symptome": plot_symptome(data["symptome"], user_id),
-        "mahlzeit": plot_mahlzeit(data["mahlzeit"], user_id),
-    }
+# Ergebnis-Schlüssel -> Firestore-Subcollection
+COLLECTIONS = {
+    "stuhlgang": "stuhlgaenge",
+    "stimmung": "stimmungen",
+    "symptome": "symptoms",
+    "mahlzeit": "mahlzeiten",
+}
+
+
+# Ergebnis-Schlüssel -> Plot-Funktion (mit pdf=PdfPages zeichnen sie direkt in den Export)
+PLOTTERS = {
+    "stuhlgang": plot_stuhlgang,
+    "stimmung": plot_stimmung,
+    "symptome": plot_symptome,
+    "mahlzeit": plot_mahlzeit,
+}
+
+
+# Plot-Funktionen je Ausgabeformat; SVG nur für Linie/Balken, Scatter bleiben PNG
+PLOTTERS_BY_FORMAT = {
+    "png": PLOTTERS,
+    "svg": {**PLOTTERS, "stimmung": plot_stimmung_svg, "mahlzeit": plot_mahlzeit_svg},
+}
+
+
+def _plot_all(data: dict[str, pd.DataFrame], user_id: str, plotters: dict = PLOTTERS):
+    return {key: plot(data[key], user_id) for key, plot in plotters.items()}
+
+
+def create_plot_executor(max_workers: int = PLOT_WORKERS) -> ProcessPoolExecutor | None:
+    """
+    Prozess-Pool für generate_analytics_for_user_async (None, wenn max_workers <= 0).
+    "spawn" statt fork: geforkte Kinder könnten einen gerade gehaltenen _PLOT_LOCK erben.
+    """
+    if max_workers <= 0:
+        return None
+    return ProcessPoolExecutor(max_workers=max_workers,
+                               mp_context=multiprocessing.get_context("spawn"),
+                               initializer=_init_plot_worker)
+
+
+def _init_plot_worker():
+    # Worker-Prozesse erben die Logging-Konfiguration der API nicht
+    logging.basicConfig(level=logging.INFO, format=LOG_FORMAT)
+
+
+def fetch_all_for_user(db, user_id: str, projected: bool = True) -> dict[str, pd.DataFrame]:
+    """
+    Holt alle Subcollections eines Users parallel (ein Thread pro Collection),
+    Schlüssel wie in COLLECTIONS. Der Firestore-Client ist für Lesezugriffe thread-sicher.
+    projected=False lädt vollständige Dokumente (z. B. für die Rohdaten im PDF-Export).
+    """
+    fetch = fetch_plot_data if projected else fetch_for_user
+    with ThreadPoolExecutor(max_workers=len(COLLECTIONS)) as ex:
+        futures = {key: ex.submit(fetch, db, name, user_id) for key, name in COLLECTIONS.items()}
+        return {key: f.result() for key, f in futures.items()}
+
+
+def generate_analytics_for_user(user_id: str, service_account: str | None = None, db=None,
+                                data: dict[str, pd.DataFrame] | None = None):
+    """
+    Erzeugt die vier Diagramme. Mit `data` (Ergebnis von fetch_all_for_user)
+    werden bereits geladene DataFrames verwendet statt erneut aus Firestore zu lesen.
+    """
+    if data is None:
+        if db is None:
+            db = get_db(service_account)
+        data = fetch_all_for_user(db, user_id)
+    return _plot_all(data, user_id)
+
+
+async def fetch_all(db, user_id: str) -> dict[str, pd.DataFrame]:
+    """
+    Holt alle Subcollections eines Users nebenläufig über den AsyncClient
+    (ohne Worker-Threads, die Streams teilen sich den Event-Loop).
+    """
+    frames = await asyncio.gather(
+        *(fetch_plot_data_async(db, name, user_id) for name in COLLECTIONS.values())
+    )
+    return dict(zip(COLLECTIONS, frames))
+
+
+async def generate_analytics_for_user_async(user_id: str, service_account: str | None = None,
+                                            db=None, executor: ProcessPoolExecutor | None = None,
+                                            fmt: str = "png"):
+    """
+    Async-Variante für die API: Firestore-Fetches laufen nebenläufig.
+    `db` ist ein AsyncClient (get_async_db), nicht der Client aus get_db.
+    Mit `executor` werden die vier Diagramme parallel in eigenen Prozessen gerendert,
+    sonst nacheinander in einem Worker-Thread (matplotlib ist nicht event-loop-sicher).
+    fmt="svg" erzeugt Stimmungs- und Mahlzeiten-Diagramm als SVG ohne matplotlib.
+    """
+    plotters = PLOTTERS_BY_FORMAT[fmt]
+    if db is None:
+        db = await asyncio.to_thread(get_async_db, service_account)
+    data = await fetch_all(db, user_id)
+    if executor is None:
+        return await asyncio.to_thread(_plot_all, data, user_id, plotters)
+
+    loop = asyncio.get_running_loop()
+    paths = await asyncio.gather(
+        *(loop.run_in_executor(executor, plot, data[key], user_id) for key, plot in plotters.items())
+    )
+    return dict(zip(plotters, paths))
 
 # -------------------------------------------------------------------
 # CLI-Aufruf
@@ -214,6 +805,7 @@ def main():
     parser.add_argument("--user", required=True, help="Firebase UID des Users (users/<uid>/...)")
     parser.add_argument("--creds", help="Pfad zur serviceAccount.json (optional)")
     args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
     results = generate_analytics_for_user(args.user, args.creds)
     print("\n✓ Analytics complete.")
     for k, v in results.items():
@@ -1,108 +1,112 @@
-from pathlib import Path
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_pdf import PdfPages
-import pandas as pd
-import json
 import datetime
-import os
+import logging
 
-from cedmate_analytics import generate_analytics_for_user, connect_firestore, fetch_for_user
-from cedmate_analytics import OUTPUT_DIR  
+from cedmate_analytics import get_db, fetch_all_for_user
+from cedmate_analytics import output_paths, COLLECTIONS, PLOTTERS, A4_FIGSIZE
 
+logger = logging.getLogger(__name__)
 
-def generate_export_pdf_for_user(user_id: str):
+# Raw-data text block: 7 pt monospace is ~4.2 pt per character, so 120 characters
+# (~505 pt) fit between the 5 % margins of an A4 page (595 pt wide)
+RAW_FONT_SIZE = 7
+RAW_LINE_WIDTH = 120
+RAW_LEFT_MARGIN = 0.05
+RAW_TOP = 0.86  # below the page title
+
+
+def generate_export_pdf_for_user(user_id: str, db=None):
     """
     Creates a PDF summary for the given user.
     Includes:
       - Title page
-      - All analytics plots (PNG)
+      - All analytics plots (drawn directly into the PDF as vector pages)
       - Raw data tables (from Firestore)
     Uses only matplotlib (PdfPages).
+    `db` is an optional, already initialized Firestore client.
     Returns the full output path.
     """
 
-    print(f"📄 Starte PDF-Export für {user_id}")
+    # matplotlib erst beim ersten Export laden (nicht schon beim Import von api.py);
+    # Agg vor pyplot setzen, damit nicht nach Tk/Qt gesucht wird
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    from matplotlib.backends.backend_pdf import PdfPages
 
-    pdf_path = OUTPUT_DIR / f"export_{user_id}.pdf"
+    logger.info("📄 Starte PDF-Export für %s", user_id)
 
-    # ------------------------------
-    # 1. Fetch analytics + PNGs
-    # ------------------------------
-    results = generate_analytics_for_user(user_id)
-    plot_paths = {k: Path(v) for k, v in results.items() if v and Path(v).exists()}
+    pdf_path = output_paths(user_id)["export"]
 
     # ------------------------------
-    # 2. Fetch raw Firestore data
+    # 1. Fetch raw Firestore data (once, full documents)
     # ------------------------------
-    db_data = {}
-    collections = ["stuhlgaenge", "stimmungen", "symptoms", "mahlzeiten"]
+    if db is None:
+        db = get_db()
+    data = fetch_all_for_user(db, user_id, projected=False)
 
-    # Re-fetch raw data (pandas DataFrames)
-    
-    db = connect_firestore()
-
-    for col in collections:
-        df = fetch_for_user(db, col, user_id)
-        db_data[col] = df
+    # Raw-data pages keep the Firestore collection names as headings;
+    # empty collections get no page of their own, only a line on the title page
+    db_data = {COLLECTIONS[key]: df for key, df in data.items() if not df.empty}
+    empty = [COLLECTIONS[key] for key, df in data.items() if df.empty]
 
     # ------------------------------
-    # 3. Build PDF
+    # 2. Build PDF
     # ------------------------------
-    with PdfPages(pdf_path) as pdf:
-
-        # ----- Page 1: Title Page -----
-        fig, ax = plt.subplots(figsize=(8.27, 11.69))  # A4 size
-        ax.axis("off")
-
-        title = "CEDmate – Datenexport"
-        subtitle = f"Benutzer: {user_id}"
-        timestamp = datetime.datetime.now().strftime("%d.%m.%Y – %H:%M")
+    # One A4 figure for title and raw-data pages, cleared per page
+    fig = plt.figure(figsize=A4_FIGSIZE)
 
-        ax.text(0.5, 0.75, title, fontsize=24, ha="center", va="center")
-        ax.text(0.5, 0.65, subtitle, fontsize=16, ha="center")
-        ax.text(0.5, 0.60, f"Erstellt am: {timestamp}", fontsize=12, ha="center")
+    try:
+        with PdfPages(pdf_path) as pdf:
 
-        pdf.savefig(fig)
-        plt.close(fig)
-
-        # ----- Pages 2+: Plots -----
-        for name, path in plot_paths.items():
-            fig, ax = plt.subplots(figsize=(8.27, 11.69))
+            # ----- Page 1: Title Page -----
+            ax = fig.add_subplot()
             ax.axis("off")
 
-            ax.set_title(name.capitalize(), fontsize=18, pad=20)
+            title = "CEDmate – Datenexport"
+            subtitle = f"Benutzer: {user_id}"
+            timestamp = datetime.datetime.now().strftime("%d.%m.%Y – %H:%M")
 
-            img = plt.imread(str(path))
-            ax.imshow(img)
-            ax.axis("off")
+            ax.text(0.5, 0.75, title, fontsize=24, ha="center", va="center")
+            ax.text(0.5, 0.65, subtitle, fontsize=16, ha="center")
+            ax.text(0.5, 0.60, f"Erstellt am: {timestamp}", fontsize=12, ha="center")
+            if empty:
+                ax.text(0.5, 0.50, "Keine Daten vorhanden: " + ", ".join(empty), fontsize=12, ha="center")
 
-            pdf.savefig(fig)
-            plt.close(fig)
+            pdf.savefig(fig, bbox_inches=None)
 
-        # ----- Final pages: Raw Data -----
-        for col, df in db_data.items():
-            fig, ax = plt.subplots(figsize=(8.27, 11.69))
-            ax.axis("off")
+            # ----- Pages 2+: Plots (no PNG round-trip) -----
+            # Plotters get a copy: time detection converts columns in place,
+            # the raw-data pages must show the stored values
+            for key, plot in PLOTTERS.items():
+                if not data[key].empty:
+                    plot(data[key].copy(), user_id, pdf=pdf)
+
+            # ----- Final pages: Raw Data -----
+            for col, df in db_data.items():
+                fig.clf()
+                ax = fig.add_subplot()
+                ax.axis("off")
 
-            ax.set_title(f"Rohdaten – {col}", fontsize=16, pad=20)
+                ax.set_title(f"Rohdaten – {col}", fontsize=16, pad=20)
 
-            if df.empty:
-                ax.text(0.1, 0.8, "Keine Daten vorhanden.", fontsize=12)
-            else:
-                # Convert to table
+                # Monospaced text block instead of ax.table (one artist instead of one per cell)
                 # Limit to first 30 rows for readability
                 small_df = df.head(30)
 
-                table = ax.table(
-                    cellText=small_df.values,
-                    colLabels=small_df.columns,
-                    loc="center",
-                    cellLoc="left",
+                # Figure coordinates from the left page margin; wide frames wrap into
+                # column blocks at RAW_LINE_WIDTH characters instead of running off the page
+                fig.text(
+                    RAW_LEFT_MARGIN, RAW_TOP,
+                    small_df.to_string(index=False, max_cols=6, max_colwidth=25,
+                                       line_width=RAW_LINE_WIDTH),
+                    family="monospace",
+                    fontsize=RAW_FONT_SIZE,
+                    va="top",
                 )
-                table.scale(1, 1.2)
 
-            pdf.savefig(fig)
-            plt.close(fig)
+                pdf.savefig(fig, bbox_inches=None)
+    finally:
+        plt.close(fig)
 
-    print(f"📄 PDF erstellt: {pdf_path}")
+    logger.info("📄 PDF erstellt: %s", pdf_path)
     return pdf_path
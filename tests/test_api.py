@@ -0,0 +1,78 @@
+import unittest
+
+from fastapi.testclient import TestClient
+
+import api
+
+# Ohne "with": kein Lifespan, also keine Firebase-Verbindung. /analytics/invalidate
+# braucht keine Datenbank und zeigt, ob die Middleware den Request durchlässt.
+PATH = "/analytics/invalidate?user=u1"
+KEY = {"x-api-key": api.API_KEY}
+
+
+class AuthMiddlewareTest(unittest.TestCase):
+    def setUp(self):
+        self.client = TestClient(api.app)
+
+    def post(self, **headers):
+        return self.client.post(PATH, headers=headers)
+
+    def test_missing_key(self):
+        response = self.post(origin="http://localhost")
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.json(), {"detail": "Unauthorized: Invalid API key"})
+
+    def test_wrong_key(self):
+        response = self.post(**{"x-api-key": "falsch", "origin": "http://localhost"})
+        self.assertEqual(response.status_code, 401)
+
+    def test_disallowed_origin(self):
+        response = self.post(**KEY, origin="https://example.com")
+        self.assertEqual(response.status_code, 403)
+
+    def test_look_alike_origin(self):
+        for origin in ("https://ahmad-kalaf.github.io.evil.com", "http://localhost.evil.com"):
+            response = self.post(**KEY, origin=origin)
+            self.assertEqual(response.status_code, 403, origin)
+
+    def test_localhost_origin_with_port(self):
+        response = self.post(**KEY, origin="http://localhost:8080")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["user"], "u1")
+
+    def test_trusted_user_agent_without_origin(self):
+        response = self.post(**KEY, **{"user-agent": "Dart/3.4 (dart:io)"})
+        self.assertEqual(response.status_code, 200)
+
+    def test_unknown_user_agent_without_origin(self):
+        response = self.post(**KEY, **{"user-agent": "curl/8.0"})
+        self.assertEqual(response.status_code, 403)
+
+    def test_preflight_without_key(self):
+        response = self.client.options(PATH, headers={
+            "origin": "https://ahmad-kalaf.github.io",
+            "access-control-request-method": "POST",
+            "access-control-request-headers": "x-api-key",
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers["access-control-allow-origin"],
+                         "https://ahmad-kalaf.github.io")
+
+    def test_cors_headers_on_401(self):
+        response = self.post(origin="http://localhost:8080")
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.headers["access-control-allow-origin"], "http://localhost:8080")
+
+    def test_unprotected_path_without_key(self):
+        self.assertEqual(self.client.get("/").status_code, 200)
+
+
+class AppConfigTest(unittest.TestCase):
+    def test_empty_api_key_rejected(self):
+        with self.assertRaises(ValueError):
+            api.AppConfig.build("", api.ALLOWED_ORIGINS, api.LOCALHOST_REGEX,
+                                api.TRUSTED_USER_AGENTS)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,143 @@
+import datetime
+import unittest
+
+import pandas as pd
+from google.auth.credentials import AnonymousCredentials
+from google.cloud import firestore
+
+import cedmate_analytics as ca
+
+
+class _Doc:
+    def __init__(self, doc_id, data):
+        self.id = doc_id
+        self._data = data
+
+    def to_dict(self):
+        return dict(self._data)
+
+
+class _Query:
+    """Minimaler Firestore-Ersatz, der select/limit/start_after wie der Server anwendet."""
+
+    def __init__(self, docs, fields=None, size=None):
+        self.docs, self.fields, self.size = docs, fields, size
+
+    def select(self, fields):
+        return _Query(self.docs, [f.strip("`") for f in fields], self.size)
+
+    def limit(self, size):
+        return _Query(self.docs, self.fields, size)
+
+    def start_after(self, doc):
+        index = next(i for i, d in enumerate(self.docs) if d.id == doc.id)
+        return _Query(self.docs[index + 1:], self.fields, self.size)
+
+    def stream(self):
+        for d in self.docs[:self.size]:
+            data = d.to_dict()
+            if self.fields is not None:
+                data = {k: v for k, v in data.items() if k in self.fields}
+            yield _Doc(d.id, data)
+
+
+class _StubDB:
+    """users/<uid>/<subcollection> liefert immer dieselben Dokumente."""
+
+    def __init__(self, docs):
+        self.docs = docs
+
+    def collection(self, name):
+        return self if name == "users" else _Query(self.docs)
+
+    def document(self, name):
+        return self
+
+
+class PlotProjectionTest(unittest.TestCase):
+    def test_projection_builds_with_real_clients(self):
+        for client_cls in (firestore.Client, firestore.AsyncClient):
+            client = client_cls(project="test", credentials=AnonymousCredentials())
+            paths = {}
+            for name, fields in ca.PLOT_FIELDS.items():
+                query = ca._subcollection_query(client, "u1", name, fields)
+                page, _ = ca._page_query(query, None, None)
+                paths[name] = [f.field_path for f in page._to_protobuf().select.fields]
+                self.assertEqual(len(paths[name]), len(fields), (client_cls.__name__, name))
+            self.assertIn("`intensität`", paths["symptoms"])
+            self.assertIn("zeit", paths["symptoms"])
+
+    def test_projection_covers_app_field_names(self):
+        base = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+        docs = [_Doc(f"d{i}", {"createdAt": base + datetime.timedelta(days=i), "stimmung": i % 5,
+                               "notiz": "x"})
+                for i in range(5)]
+        with self.assertNoLogs(ca.logger, "WARNING"):
+            df = ca.fetch_plot_data(_StubDB(docs), "stimmungen", "u1")
+        self.assertNotIn("notiz", df.columns)
+        self.assertEqual(ca._detect_time_col(df), "createdAt")
+        self.assertEqual(ca._detect_value_col(df, ca.STIMMUNG_VALUE_COLS), "stimmung")
+
+    def test_full_fetch_when_projection_misses_plot_fields(self):
+        base = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+        docs = [_Doc(f"d{i}", {"erfasstAm": base + datetime.timedelta(days=i), "laune": i % 5})
+                for i in range(5)]
+        with self.assertLogs(ca.logger, "WARNING"):
+            df = ca.fetch_plot_data(_StubDB(docs), "stimmungen", "u1")
+        self.assertEqual(ca._detect_time_col(df), "erfasstAm")
+        self.assertEqual(ca._detect_value_col(df, ca.STIMMUNG_VALUE_COLS), "laune")
+
+
+class FrameBuildTest(unittest.TestCase):
+    def test_value_column_stays_numeric_when_missing_for_many_docs(self):
+        base = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+        docs = [_Doc(f"d{i:04d}", {"zeit": base + datetime.timedelta(hours=i),
+                                   "wert": None if i < 600 else i % 10})
+                for i in range(1200)]
+        df = ca._df_from_user_subcollection(_StubDB(docs), "u1", "stimmungen")
+        self.assertEqual(len(df), 1200)
+        self.assertTrue(pd.api.types.is_numeric_dtype(df["wert"].dtype))
+        self.assertEqual(ca._detect_value_col(df, ca.STIMMUNG_VALUE_COLS), "wert")
+
+    def test_thinned_fetch_keeps_at_most_max_rows_across_collection(self):
+        base = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+        docs = [_Doc(f"d{i:04d}", {"zeit": base + datetime.timedelta(hours=i), "typ": i % 7 + 1,
+                                   **({"notiz": "x"} if i == 0 else {})})
+                for i in range(1000)]
+        df = ca._df_from_user_subcollection(_StubDB(docs), "u1", "stuhlgaenge", max_rows=100)
+        self.assertLessEqual(len(df), 100)
+        self.assertGreater(len(df), 50)
+        self.assertEqual(df["id"].iloc[0], "d0000")
+        self.assertGreater(df["id"].iloc[-1], "d0900")
+        self.assertEqual(df["notiz"].notna().sum(), 1)
+
+
+class TimeColumnTest(unittest.TestCase):
+    # Sommer-/Winterzeit: gleiche Spalte mit +01:00 und +02:00
+    MIXED = ["2024-03-30T08:00:00+01:00", "2024-03-30T19:00:00+01:00",
+             "2024-03-31T08:00:00+02:00", "2024-04-01T01:30:00+02:00"]
+
+    def test_mixed_offset_strings_become_utc_datetime(self):
+        df = pd.DataFrame({"zeit": self.MIXED})
+        self.assertEqual(ca._detect_time_col(df), "zeit")
+        self.assertTrue(pd.api.types.is_datetime64_any_dtype(df["zeit"]))
+        per_day = ca._meals_per_day(df, "u1")
+        # 01:30 +02:00 ist 23:30 UTC am Vortag
+        self.assertEqual([str(d) for d in per_day.index], ["2024-03-30", "2024-03-31"])
+        self.assertEqual(per_day.tolist(), [2, 2])
+
+    def test_unparseable_name_match_falls_through(self):
+        df = pd.DataFrame({"zeitraum": ["morgens", "abends"], "datum": self.MIXED[:2]})
+        self.assertEqual(ca._detect_time_col(df), "datum")
+
+    def test_svg_plots_with_mixed_offsets(self):
+        uid = "test-mixed-offsets"
+        paths = [ca.plot_mahlzeit_svg(pd.DataFrame({"zeit": self.MIXED}), uid),
+                 ca.plot_stimmung_svg(pd.DataFrame({"zeit": self.MIXED, "wert": [1, 2, 3, 4]}), uid)]
+        for path in paths:
+            self.assertTrue(path.exists())
+            path.unlink()
+
+
+if __name__ == "__main__":
+    unittest.main()